@@ -1,8 +1,13 @@
 # config.py
 # Simple centralized configuration values.
+import os
 
 DATABASE_FILE = "puchmatch.db"
 
+# SQLite connection pool size (long-lived connections reused across requests)
+DB_POOL_SIZE = min(32, (os.cpu_count() or 1) * 4)
+DB_POOL_TIMEOUT = 10.0  # seconds to wait for a free pooled connection
+
 # Default matchmaking parameters
 MAX_MATCH_RESULTS = 5  # how many candidate matches to return if using matcher
 MIN_COMMON_INTERESTS = 1  # minimum number of common interests to consider a match
@@ -1,64 +1,192 @@
 # database.py
+import queue
 import sqlite3
-from typing import List, Optional, Tuple, Dict
-from config import DATABASE_FILE
+import threading
+from contextlib import contextmanager
+from typing import FrozenSet, Iterator, List, Optional, Tuple, Dict
+from config import DATABASE_FILE, DB_POOL_SIZE, DB_POOL_TIMEOUT
+import interest_index
 
-def get_conn():
-    return sqlite3.connect(DATABASE_FILE, check_same_thread=False)
+# Parsed view of the matchable users (those with at least one interest), kept
+# in sync by the write helpers below so the matcher never re-reads or re-parses rows.
+INTERESTS_CACHE: Dict[str, FrozenSet[str]] = {}
+NAME_CACHE: Dict[str, str] = {}
+# Held across each write and its cache update so concurrent writes to the same
+# user commit and update the caches in the same order.
+_WRITE_LOCK = threading.Lock()
+
+def _parse_interests(interests_str: str) -> FrozenSet[str]:
+    if not interests_str:
+        return frozenset()
+    # split by comma, strip whitespace, lowercase
+    return frozenset(p.strip().lower() for p in interests_str.split(",") if p.strip())
+
+def _cache_user(user_id: str, name: str, interests: str) -> None:
+    parsed = _parse_interests(interests)
+    if not parsed:
+        _uncache_user(user_id)
+        return
+    INTERESTS_CACHE[user_id] = parsed
+    NAME_CACHE[user_id] = name
+    interest_index.index_user(user_id, parsed)
+
+def _uncache_user(user_id: str) -> None:
+    INTERESTS_CACHE.pop(user_id, None)
+    NAME_CACHE.pop(user_id, None)
+    interest_index.drop_user(user_id)
+
+def _connect(read_only: bool = False) -> sqlite3.Connection:
+    if read_only:
+        conn = sqlite3.connect(f"file:{DATABASE_FILE}?mode=ro", uri=True, check_same_thread=False)
+    else:
+        conn = sqlite3.connect(DATABASE_FILE, check_same_thread=False)
+        # WAL is stored in the db file, so readers never block behind the writer
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA cache_size=-20000")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA mmap_size=268435456")
+    return conn
+
+class ConnectionPool:
+    """A bounded pool of long-lived SQLite connections reused across requests."""
+
+    def __init__(self, size: int = DB_POOL_SIZE, read_only: bool = False):
+        self._read_only = read_only
+        self._pool = queue.Queue(maxsize=size)
+        for _ in range(size):
+            self._pool.put(_connect(read_only))
+
+    def _ping(self, conn: sqlite3.Connection) -> bool:
+        try:
+            conn.execute("SELECT 1")
+            return True
+        except sqlite3.Error:
+            return False
+
+    @contextmanager
+    def connection(self):
+        try:
+            conn = self._pool.get(timeout=DB_POOL_TIMEOUT)
+        except queue.Empty:
+            raise sqlite3.OperationalError("timed out waiting for a pooled connection") from None
+        try:
+            # a None slot is one whose reconnect failed earlier; retry it now
+            if conn is None or not self._ping(conn):
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except sqlite3.Error:
+                        pass
+                conn = None
+                conn = _connect(self._read_only)
+            yield conn
+        except Exception:
+            if conn is not None:
+                conn.rollback()
+            raise
+        finally:
+            # always give the slot back, even if reconnecting failed
+            self._pool.put(conn)
+
+    def close(self) -> None:
+        while True:
+            try:
+                conn = self._pool.get_nowait()
+            except queue.Empty:
+                break
+            if conn is not None:
+                conn.close()
+
+_pool: Optional[ConnectionPool] = None
+_read_pool: Optional[ConnectionPool] = None
+
+def _get_pool(read_only: bool = False) -> ConnectionPool:
+    global _pool, _read_pool
+    if read_only:
+        if _read_pool is None:
+            # the db file must already exist (init_db) for mode=ro to open it
+            _get_pool()
+            _read_pool = ConnectionPool(read_only=True)
+        return _read_pool
+    if _pool is None:
+        _pool = ConnectionPool()
+    return _pool
+
+@contextmanager
+def get_conn(read_only: bool = False):
+    """Borrow a pooled connection; it is returned to the pool on exit."""
+    with _get_pool(read_only).connection() as conn:
+        yield conn
 
 def init_db():
     """Create the users table if it doesn't exist. Call this once at app startup."""
-    conn = get_conn()
-    c = conn.cursor()
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS users (
-            user_id TEXT PRIMARY KEY,
-            name TEXT,
-            interests TEXT
-        )
-    """)
-    conn.commit()
-    conn.close()
+    with get_conn() as conn:
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS users (
+                user_id TEXT PRIMARY KEY,
+                name TEXT,
+                interests TEXT
+            )
+        """)
+        conn.execute("""
+            CREATE INDEX IF NOT EXISTS idx_users_has_interests ON users(user_id)
+            WHERE interests IS NOT NULL AND interests != ''
+        """)
+        conn.commit()
+    with _WRITE_LOCK:
+        for user_id, name, interests in iter_users():
+            _cache_user(user_id, name, interests)
 
 def add_or_update_user(user_id: str, name: str = None, interests: str = None) -> None:
     """
     Insert a new user or update existing one.
     'interests' is stored as a comma-separated string, e.g. "music,cricket,aeromodelling"
     """
-    conn = get_conn()
-    c = conn.cursor()
-    # Upsert style
-    c.execute("""
-        INSERT INTO users (user_id, name, interests)
-        VALUES (?, ?, ?)
-        ON CONFLICT(user_id) DO UPDATE SET
-            name=excluded.name,
-            interests=excluded.interests
-    """, (user_id, name, interests))
-    conn.commit()
-    conn.close()
+    with _WRITE_LOCK:
+        with get_conn() as conn:
+            # Upsert style
+            conn.execute("""
+                INSERT INTO users (user_id, name, interests)
+                VALUES (?, ?, ?)
+                ON CONFLICT(user_id) DO UPDATE SET
+                    name=excluded.name,
+                    interests=excluded.interests
+            """, (user_id, name, interests))
+            conn.commit()
+        _cache_user(user_id, name, interests)
 
 def get_user(user_id: str) -> Optional[Tuple[str, str, str]]:
     """Return a tuple (user_id, name, interests) or None"""
-    conn = get_conn()
-    c = conn.cursor()
-    c.execute("SELECT user_id, name, interests FROM users WHERE user_id = ?", (user_id,))
-    row = c.fetchone()
-    conn.close()
-    return row
+    with get_conn(read_only=True) as conn:
+        return conn.execute("SELECT user_id, name, interests FROM users WHERE user_id = ?", (user_id,)).fetchone()
 
 def delete_user(user_id: str) -> None:
-    conn = get_conn()
-    c = conn.cursor()
-    c.execute("DELETE FROM users WHERE user_id = ?", (user_id,))
-    conn.commit()
-    conn.close()
+    with _WRITE_LOCK:
+        with get_conn() as conn:
+            conn.execute("DELETE FROM users WHERE user_id = ?", (user_id,))
+            conn.commit()
+        _uncache_user(user_id)
 
 def get_all_users() -> List[Tuple[str, str, str]]:
     """Return list of tuples (user_id, name, interests)"""
-    conn = get_conn()
-    c = conn.cursor()
-    c.execute("SELECT user_id, name, interests FROM users")
-    rows = c.fetchall()
-    conn.close()
-    return rows
+    with get_conn(read_only=True) as conn:
+        return conn.execute("SELECT user_id, name, interests FROM users").fetchall()
+
+def iter_users(exclude_id: Optional[str] = None) -> Iterator[Tuple[str, str, str]]:
+    """
+    Stream (user_id, name, interests) for users that have interests, optionally
+    skipping `exclude_id`. Rows are fetched in chunks rather than all at once.
+    """
+    with get_conn(read_only=True) as conn:
+        c = conn.cursor()
+        c.arraysize = 256
+        c.execute("""
+            SELECT user_id, name, interests FROM users
+            WHERE interests IS NOT NULL AND interests != '' AND (? IS NULL OR user_id != ?)
+        """, (exclude_id, exclude_id))
+        while True:
+            rows = c.fetchmany()
+            if not rows:
+                break
+            yield from rows
@@ -0,0 +1,76 @@
+# interest_index.py
+# Bitset encoding of every user's interests so the matcher can score all
+# users against one query with a single vectorized popcount.
+import threading
+from typing import Dict, FrozenSet, List, Optional, Tuple
+import numpy as np
+
+VOCAB: Dict[str, int] = {}  # interest -> bit position
+USER_IDS: List[str] = []  # row -> user_id
+ROW_OF: Dict[str, int] = {}  # user_id -> row
+USER_BITS = np.zeros((64, 1), dtype=np.uint64)  # rows beyond len(USER_IDS) are spare capacity
+# Guards all of the above: writers swap-remove rows and reallocate USER_BITS.
+_LOCK = threading.Lock()
+
+def _encode(interests: FrozenSet[str]) -> np.ndarray:
+    global USER_BITS
+    for interest in interests:
+        if interest not in VOCAB:
+            VOCAB[interest] = len(VOCAB)
+    words = (len(VOCAB) + 63) // 64
+    if words > USER_BITS.shape[1]:
+        extra = np.zeros((USER_BITS.shape[0], words - USER_BITS.shape[1]), dtype=np.uint64)
+        USER_BITS = np.hstack([USER_BITS, extra])
+    row = np.zeros(USER_BITS.shape[1], dtype=np.uint64)
+    for interest in interests:
+        bit = VOCAB[interest]
+        row[bit >> 6] |= np.uint64(1) << np.uint64(bit & 63)
+    return row
+
+def index_user(user_id: str, interests: FrozenSet[str]) -> None:
+    """Insert or re-encode the row for `user_id`."""
+    with _LOCK:
+        _index_user(user_id, interests)
+
+def _index_user(user_id: str, interests: FrozenSet[str]) -> None:
+    global USER_BITS
+    row_bits = _encode(interests)
+    row = ROW_OF.get(user_id)
+    if row is None:
+        row = len(USER_IDS)
+        if row == USER_BITS.shape[0]:
+            USER_BITS = np.vstack([USER_BITS, np.zeros_like(USER_BITS)])
+        USER_IDS.append(user_id)
+        ROW_OF[user_id] = row
+    USER_BITS[row] = row_bits
+
+def drop_user(user_id: str) -> None:
+    """Remove `user_id` by moving the last row into its slot."""
+    with _LOCK:
+        _drop_user(user_id)
+
+def _drop_user(user_id: str) -> None:
+    row = ROW_OF.pop(user_id, None)
+    if row is None:
+        return
+    last = len(USER_IDS) - 1
+    last_id = USER_IDS.pop()
+    if row != last:
+        USER_BITS[row] = USER_BITS[last]
+        USER_IDS[row] = last_id
+        ROW_OF[last_id] = row
+    USER_BITS[last] = 0
+
+def scores_for(user_id: str) -> Optional[Tuple[np.ndarray, Tuple[str, ...]]]:
+    """
+    Number of interests each indexed row shares with `user_id` (its own row is -1),
+    plus a snapshot of the row -> user_id mapping those scores were computed against.
+    """
+    with _LOCK:
+        row = ROW_OF.get(user_id)
+        if row is None:
+            return None
+        bits = USER_BITS[:len(USER_IDS)]
+        scores = np.bitwise_count(bits & bits[row]).sum(axis=1, dtype=np.int64)
+        scores[row] = -1
+        return scores, tuple(USER_IDS)
@@ -1,9 +1,16 @@
 import os
+import asyncio
+import bisect
+import hmac
+import time
+from contextlib import asynccontextmanager
+import anyio
+import orjson
 from dotenv import load_dotenv
-from typing import Dict, List, Optional
-from fastapi import FastAPI, HTTPException, Header, Request
-from fastapi.responses import JSONResponse
-from pydantic import BaseModel
+from typing import Annotated, Deque, Dict, List, Optional, Set, Tuple
+from fastapi import APIRouter, Depends, FastAPI, HTTPException, Request
+from fastapi.responses import ORJSONResponse, Response
+from pydantic import BaseModel, ConfigDict, StringConstraints
 from collections import deque
 
 # Load .env file
@@ -12,56 +19,183 @@ load_dotenv()
 AUTH_TOKEN = os.getenv("AUTH_TOKEN", "changeme")
 OWNER_PHONE = os.getenv("OWNER_PHONE", "")
 
+AUTH_HEADER_PREFIX = b"Bearer "
+AUTH_BYTES = AUTH_TOKEN.encode()
+
 if AUTH_TOKEN == "changeme":
     print("⚠ WARNING: AUTH_TOKEN is still 'changeme'. Please set a secure token in your .env")
 if not OWNER_PHONE:
     print("⚠ WARNING: OWNER_PHONE is not set in your .env file")
 
-app = FastAPI(title="PuchMatch (MCP) Server")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Endpoints are async and never touch the threadpool, but give any sync
+    # dependency added later more headroom than anyio's default of 40 threads.
+    anyio.to_thread.current_default_thread_limiter().total_tokens = 100
+    yield
+
+# Docs/OpenAPI are off: auth is a per-route dependency, so they would otherwise be public.
+app = FastAPI(
+    title="PuchMatch (MCP) Server",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse,
+    docs_url=None,
+    redoc_url=None,
+    openapi_url=None,
+)
 
 # ----------------------
 # In-memory storage
 # ----------------------
+# waiting_queue holds (seq, user_id); an entry is live only while join_seq[user_id] == seq.
+# Leaving just drops the user from join_seq/waiting_set and records the seq in
+# departed_seqs; the stale entry is skipped when it reaches the head.
 waiting_queue = deque()
+waiting_set: Set[str] = set()  # live waiting users, for O(1) membership checks
+join_seq: Dict[str, int] = {}  # user_id -> sequence number of their live entry
+departed_seqs: List[int] = []  # sorted seqs of stale entries still in waiting_queue
+head_seq = 0  # seq of the entry at the head of waiting_queue
+next_seq = 0
 active_pairs: Dict[str, str] = {}
-inbox: Dict[str, List[Dict]] = {}
+# user_id -> (partner they were just split from by a skip, monotonic ns until
+# the two may be paired again); recorded under both user ids
+RECENTLY_UNPAIRED: Dict[str, Tuple[str, int]] = {}
+SKIP_COOLDOWN_NS = 5_000_000_000
+inbox: Dict[str, Deque[bytes]] = {}  # messages are stored already JSON-encoded
+NONEMPTY: Set[str] = set()  # users with at least one message waiting in their inbox
 meta: Dict[str, Dict] = {}
 
+# Inboxes are ring buffers: if a user never polls, their oldest messages are
+# dropped (and counted in meta["dropped"]) instead of growing without bound.
+INBOX_MAXLEN = 200
+
+# Freelists of cleared inbox deques / meta dicts so the join -> leave -> join
+# churn reuses containers instead of allocating new ones every time.
+POOL_MAX = 1024
+INBOX_POOL: List[Deque[bytes]] = [deque(maxlen=INBOX_MAXLEN) for _ in range(POOL_MAX)]
+META_POOL: List[Dict] = [{} for _ in range(POOL_MAX)]
+
+# All of the above is per-process state, so run a single worker. Mutating
+# endpoints take STATE_LOCK so the queue/pair/inbox invariants hold together.
+STATE_LOCK = asyncio.Lock()
+
 # ----------------------
 # Pydantic models
 # ----------------------
+# Constraints are enforced by pydantic-core during parsing (422 on failure),
+# so handlers get stripped, length-checked strings.
+UserId = Annotated[str, StringConstraints(strip_whitespace=True, min_length=1, max_length=64)]
+
 class ConnectPayload(BaseModel):
-    user_id: str
-    nickname: Optional[str] = None
+    model_config = ConfigDict(extra="ignore", frozen=True)
+    user_id: UserId
+    nickname: Optional[Annotated[str, StringConstraints(strip_whitespace=True, max_length=32)]] = None
 
 class MessagePayload(BaseModel):
-    user_id: str
-    text: str
+    model_config = ConfigDict(extra="ignore", frozen=True)
+    user_id: UserId
+    text: Annotated[str, StringConstraints(strip_whitespace=True, min_length=1, max_length=4096)]
 
 class SimplePayload(BaseModel):
-    user_id: str
+    model_config = ConfigDict(extra="ignore", frozen=True)
+    user_id: UserId
 
 # ----------------------
-# Middleware to check Bearer token for every request
+# Bearer token check, applied to the routes that need it (not the "/" health check)
 # ----------------------
-@app.middleware("http")
-async def check_auth_middleware(request: Request, call_next):
-    auth_header = request.headers.get("Authorization")
-    if not auth_header or not auth_header.startswith("Bearer "):
-        return JSONResponse(status_code=401, content={"detail": "Missing or invalid Authorization header"})
-    token = auth_header.split("Bearer ")[1]
-    if token != AUTH_TOKEN:
-        return JSONResponse(status_code=403, content={"detail": "Invalid token"})
-    return await call_next(request)
+async def verify_token(request: Request):
+    # read the raw ASGI header bytes rather than building Starlette's Headers
+    authorization = b""
+    for name, value in request.scope["headers"]:
+        if name == b"authorization":
+            authorization = value
+            break
+    if not authorization.startswith(AUTH_HEADER_PREFIX):
+        raise HTTPException(status_code=401, detail="Missing or invalid Authorization header")
+    if not hmac.compare_digest(authorization[len(AUTH_HEADER_PREFIX):], AUTH_BYTES):
+        raise HTTPException(status_code=403, detail="Invalid token")
+
+router = APIRouter(dependencies=[Depends(verify_token)])
 
 # ----------------------
 # Helpers
 # ----------------------
+def _take_inbox() -> Deque[bytes]:
+    return INBOX_POOL.pop() if INBOX_POOL else deque(maxlen=INBOX_MAXLEN)
+
+def _release_inbox(msgs: Optional[Deque[bytes]]):
+    if msgs is not None and len(INBOX_POOL) < POOL_MAX:
+        msgs.clear()
+        INBOX_POOL.append(msgs)
+
+def _release_meta(info: Optional[Dict]):
+    if info is not None and len(META_POOL) < POOL_MAX:
+        info.clear()
+        META_POOL.append(info)
+
 def make_user_if_missing(user_id: str, nickname: Optional[str] = None):
     if user_id not in inbox:
-        inbox[user_id] = []
+        inbox[user_id] = _take_inbox()
     if user_id not in meta:
-        meta[user_id] = {"nickname": nickname or f"User-{user_id[-4:]}"}
+        info = META_POOL.pop() if META_POOL else {}
+        info["nickname"] = nickname or f"User-{user_id[-4:]}"
+        info["dropped"] = 0
+        meta[user_id] = info
+
+def deliver(user_id: str, message: bytes):
+    box = inbox.get(user_id)
+    if box is None:
+        box = inbox[user_id] = _take_inbox()
+    if len(box) == INBOX_MAXLEN:
+        info = meta.get(user_id)
+        if info is not None:
+            info["dropped"] = info.get("dropped", 0) + 1
+    box.append(message)
+    NONEMPTY.add(user_id)
+
+def _enqueue(user_id: str, front: bool = False):
+    global head_seq, next_seq
+    if front:
+        head_seq -= 1
+        seq = head_seq
+        waiting_queue.appendleft((seq, user_id))
+    else:
+        seq = next_seq
+        next_seq += 1
+        waiting_queue.append((seq, user_id))
+    join_seq[user_id] = seq
+    waiting_set.add(user_id)
+
+def _dequeue() -> str:
+    """Pop the first live waiting user; callers check waiting_set first."""
+    global head_seq
+    while True:
+        seq, user_id = waiting_queue.popleft()
+        head_seq = seq + 1
+        if join_seq.get(user_id) == seq:
+            del join_seq[user_id]
+            waiting_set.discard(user_id)
+            return user_id
+        # stale entry at the head is always the smallest departed seq
+        departed_seqs.pop(0)
+
+def _remove_waiting(user_id: str):
+    global head_seq
+    seq = join_seq.pop(user_id, None)
+    if seq is None:
+        return
+    waiting_set.discard(user_id)
+    if waiting_set:
+        bisect.insort(departed_seqs, seq)
+    else:
+        # only stale entries left, drop them all at once
+        waiting_queue.clear()
+        departed_seqs.clear()
+        head_seq = next_seq
+
+def queue_position(user_id: str) -> int:
+    seq = join_seq[user_id]
+    return seq - head_seq - bisect.bisect_left(departed_seqs, seq)
 
 def pair_two(user_a: str, user_b: str):
     active_pairs[user_a] = user_b
@@ -69,120 +203,192 @@ def pair_two(user_a: str, user_b: str):
     make_user_if_missing(user_a)
     make_user_if_missing(user_b)
 
+def _recent_partner(user_id: str) -> Optional[str]:
+    entry = RECENTLY_UNPAIRED.get(user_id)
+    if entry is None:
+        return None
+    if entry[1] <= time.monotonic_ns():
+        del RECENTLY_UNPAIRED[user_id]
+        return None
+    return entry[0]
+
+def _blocked(user_a: str, user_b: str) -> bool:
+    return _recent_partner(user_a) == user_b or _recent_partner(user_b) == user_a
+
+def match_or_enqueue(user_id: str) -> Optional[str]:
+    """
+    Pair an idle `user_id` with the first waiting user they are not blocked from
+    by a skip cooldown, or queue them. Returns the new partner, or None if queued.
+    """
+    passed_over = []
+    partner = None
+    while waiting_set:
+        candidate = _dequeue()
+        if not _blocked(user_id, candidate):
+            partner = candidate
+            break
+        passed_over.append(candidate)
+    # blocked candidates go back to the front in their original order
+    for candidate in reversed(passed_over):
+        _enqueue(candidate, front=True)
+    if partner is not None:
+        pair_two(user_id, partner)
+        return partner
+    _enqueue(user_id)
+    return None
+
+def match_waiting(user_id: str) -> Optional[str]:
+    """
+    Try to pair a user who is already waiting with the first live waiting user
+    they are not blocked from. Used when a waiting user polls (a cooldown may have
+    lapsed) and when a skip puts the old partner back in the queue.
+    """
+    if len(waiting_set) < 2:
+        return None
+    for seq, other in waiting_queue:
+        if other != user_id and join_seq.get(other) == seq and not _blocked(user_id, other):
+            break
+    else:
+        return None
+    _remove_waiting(user_id)
+    _remove_waiting(other)
+    pair_two(user_id, other)
+    return other
+
+PARTNER_LEFT_MESSAGE = orjson.dumps({"from": "system", "text": "Your partner disconnected."})
+
 def unpair(user_id: str):
     partner = active_pairs.pop(user_id, None)
     if partner:
         active_pairs.pop(partner, None)
-        inbox.setdefault(partner, []).append({"from": "system", "text": "Your partner disconnected."})
+        deliver(partner, PARTNER_LEFT_MESSAGE)
 
 # ----------------------
 # MCP / Puch required endpoints
 # ----------------------
 @app.get("/")
-def root():
+async def root():
     return {"status": "ok", "service": "PuchMatch MCP server"}
 
-@app.post("/validate")
-def validate():
+@app.post("/validate", dependencies=[Depends(verify_token)])
+async def validate():
     if not OWNER_PHONE:
         return {"phone_number": "UNKNOWN", "message": "Set OWNER_PHONE env var to your phone"}
     return {"phone_number": OWNER_PHONE}
 
 # ----------------------
-# Matchmaking endpoints (now under /mcp)
+# Matchmaking endpoints (served under both /mcp and the bare paths)
 # ----------------------
-@app.post("/mcp/join_chat")
-def join_chat(payload: ConnectPayload):
-    user_id = payload.user_id
-    nickname = payload.nickname
-    make_user_if_missing(user_id, nickname)
-
-    if user_id in active_pairs:
-        partner = active_pairs[user_id]
-        return {"status": "already_matched", "partner_id": partner, "icebreaker": "What's something you love talking about?"}
+@router.post("/join_chat")
+async def join_chat(payload: ConnectPayload):
+    async with STATE_LOCK:
+        user_id = payload.user_id
+        nickname = payload.nickname
+        make_user_if_missing(user_id, nickname)
 
-    if user_id in waiting_queue:
-        return {"status": "waiting", "queue_position": list(waiting_queue).index(user_id)}
+        if user_id in active_pairs:
+            partner = active_pairs[user_id]
+            return {"status": "already_matched", "partner_id": partner, "icebreaker": "What's something you love talking about?"}
 
-    if waiting_queue:
-        partner = waiting_queue.popleft()
-        if partner == user_id:
-            waiting_queue.appendleft(partner)
-            return {"status": "waiting"}
-        pair_two(user_id, partner)
+        if user_id in waiting_set:
+            partner = match_waiting(user_id)
+            if partner is None:
+                return {"status": "waiting", "queue_position": queue_position(user_id)}
+        else:
+            partner = match_or_enqueue(user_id)
+            if partner is None:
+                return {"status": "waiting"}
         icebreaker = "If you could have lunch with anyone (alive), who would it be?"
         return {"status": "matched", "partner_id": partner, "icebreaker": icebreaker}
-    else:
-        waiting_queue.append(user_id)
-        return {"status": "waiting"}
 
-@app.post("/mcp/send_message")
-def send_message(payload: MessagePayload):
-    user_id = payload.user_id
-    text = payload.text.strip()
-    if not text:
-        raise HTTPException(status_code=400, detail="Empty message")
+@router.post("/send_message")
+async def send_message(payload: MessagePayload):
+    async with STATE_LOCK:
+        user_id = payload.user_id
+        text = payload.text
 
-    if user_id not in active_pairs:
-        raise HTTPException(status_code=400, detail="You are not matched")
+        if user_id not in active_pairs:
+            raise HTTPException(status_code=400, detail="You are not matched")
 
-    partner = active_pairs[user_id]
-    inbox.setdefault(partner, []).append({"from": user_id, "text": text})
-    return {"status": "sent", "to": partner}
+        partner = active_pairs[user_id]
+        deliver(partner, orjson.dumps({"from": user_id, "text": text}))
+        return {"status": "sent", "to": partner}
 
-@app.get("/mcp/get_messages")
-def get_messages(user_id: str):
-    if user_id not in inbox:
-        return {"messages": []}
-    msgs = inbox.get(user_id, [])
-    inbox[user_id] = []
-    return {"messages": msgs}
+# Shared body only: FastAPI attaches per-request background tasks to a returned
+# Response, so each call needs its own Response object.
+EMPTY_MESSAGES_BYTES = b'{"messages":[]}'
 
-@app.post("/mcp/skip")
-def skip_user(payload: SimplePayload):
-    user_id = payload.user_id
-    if user_id in waiting_queue:
-        return {"status": "waiting"}
+@router.get("/get_messages")
+async def get_messages(user_id: UserId):
+    # most polls find nothing: answer those with one set lookup and the pre-encoded body
+    if user_id not in NONEMPTY:
+        return Response(content=EMPTY_MESSAGES_BYTES, media_type="application/json")
+    # read-and-clear under the same lock as send_message so no append is lost
+    async with STATE_LOCK:
+        NONEMPTY.discard(user_id)
+        box = inbox.get(user_id)
+        if not box:
+            return Response(content=EMPTY_MESSAGES_BYTES, media_type="application/json")
+        # messages are already encoded, so the body is just joined together
+        body = b'{"messages":[' + b",".join(box) + b"]"
+        box.clear()
+        info = meta.get(user_id)
+        if info is not None and info.get("dropped"):
+            body += b',"dropped":%d' % info["dropped"]
+            info["dropped"] = 0
+        return Response(content=body + b"}", media_type="application/json")
 
-    if user_id in active_pairs:
+@router.post("/skip")
+async def skip_user(payload: SimplePayload):
+    async with STATE_LOCK:
+        user_id = payload.user_id
+        if user_id in waiting_set:
+            partner = match_waiting(user_id)
+            if partner is None:
+                return {"status": "waiting"}
+            return {"status": "matched", "partner_id": partner}
+
+        # matched -> idle: the old partner goes back to the front of the queue
         partner = active_pairs.get(user_id)
-        unpair(user_id)
-        if partner:
-            waiting_queue.appendleft(partner)
-
-    make_user_if_missing(user_id)
-    if user_id in waiting_queue:
-        return {"status": "waiting"}
-    if waiting_queue:
-        partner = waiting_queue.popleft()
-        if partner == user_id:
-            waiting_queue.appendleft(partner)
+        if partner is not None:
+            unpair(user_id)
+            _enqueue(partner, front=True)
+            expiry = time.monotonic_ns() + SKIP_COOLDOWN_NS
+            RECENTLY_UNPAIRED[user_id] = (partner, expiry)
+            RECENTLY_UNPAIRED[partner] = (user_id, expiry)
+        else:
+            make_user_if_missing(user_id)
+
+        # idle -> matched with someone else, or waiting
+        new_partner = match_or_enqueue(user_id)
+        # the requeued old partner may be free to pair with someone already waiting
+        if partner is not None and partner in waiting_set:
+            match_waiting(partner)
+        if new_partner is None:
             return {"status": "waiting"}
-        pair_two(user_id, partner)
-        return {"status": "matched", "partner_id": partner}
-    else:
-        waiting_queue.append(user_id)
-        return {"status": "waiting"}
-
-@app.post("/mcp/leave")
-def leave(payload: SimplePayload):
-    user_id = payload.user_id
-    try:
-        if user_id in waiting_queue:
-            waiting_queue.remove(user_id)
-    except ValueError:
-        pass
-    if user_id in active_pairs:
-        unpair(user_id)
-    inbox.pop(user_id, None)
-    meta.pop(user_id, None)
-    return {"status": "left"}
+        return {"status": "matched", "partner_id": new_partner}
 
-@app.get("/mcp/status")
-def status(user_id: str):
+@router.post("/leave")
+async def leave(payload: SimplePayload):
+    async with STATE_LOCK:
+        user_id = payload.user_id
+        _remove_waiting(user_id)
+        if user_id in active_pairs:
+            unpair(user_id)
+        _release_inbox(inbox.pop(user_id, None))
+        NONEMPTY.discard(user_id)
+        _release_meta(meta.pop(user_id, None))
+        RECENTLY_UNPAIRED.pop(user_id, None)
+        return {"status": "left"}
+
+@router.get("/status")
+async def status(user_id: UserId):
     if user_id in active_pairs:
         return {"status": "matched", "partner_id": active_pairs[user_id]}
-    elif user_id in waiting_queue:
-        return {"status": "waiting", "queue_position": list(waiting_queue).index(user_id)}
+    elif user_id in waiting_set:
+        return {"status": "waiting", "queue_position": queue_position(user_id)}
     else:
         return {"status": "not_connected"}
+
+app.include_router(router)
+app.include_router(router, prefix="/mcp")
@@ -1,42 +1,43 @@
 # matcher.py
 from typing import List, Dict
-from database import get_user, get_all_users
+import numpy as np
+import interest_index
+from database import INTERESTS_CACHE, NAME_CACHE
 from config import MAX_MATCH_RESULTS, MIN_COMMON_INTERESTS
 
-def _parse_interests(interests_str: str) -> set:
-    if not interests_str:
-        return set()
-    # split by comma, strip whitespace, lowercase
-    parts = [p.strip().lower() for p in interests_str.split(",") if p.strip()]
-    return set(parts)
-
-def score_common_interests(set_a: set, set_b: set) -> int:
+def score_common_interests(set_a: frozenset, set_b: frozenset) -> int:
     return len(set_a & set_b)
 
 def find_matches_for_user(user_id: str) -> List[Dict]:
     """
     Return a ranked list of candidate matches for `user_id`.
     Each candidate is a dict: {user_id, name, common_interests: [...], score: N}
+    Scores come from the bitset index maintained by database.py (filled in init_db).
     """
-    me = get_user(user_id)
-    if not me:
+    scored = interest_index.scores_for(user_id)
+    me_interests = INTERESTS_CACHE.get(user_id)
+    if scored is None or me_interests is None:
         return []
+    scores, user_ids = scored
+
+    rows = np.flatnonzero(scores >= MIN_COMMON_INTERESTS)
+    if len(rows) > MAX_MATCH_RESULTS:
+        # keep every row tied with the k-th best score so the name tie-break below stays exact
+        kth = np.partition(scores[rows], len(rows) - MAX_MATCH_RESULTS)[len(rows) - MAX_MATCH_RESULTS]
+        rows = rows[scores[rows] >= kth]
 
-    me_interests = _parse_interests(me[2] or "")
     candidates = []
-    for other in get_all_users():
-        other_id, other_name, other_interests_str = other
-        if other_id == user_id:
-            continue
-        other_interests = _parse_interests(other_interests_str or "")
-        score = score_common_interests(me_interests, other_interests)
-        if score >= MIN_COMMON_INTERESTS:
-            candidates.append({
-                "user_id": other_id,
-                "name": other_name,
-                "common_interests": list(me_interests & other_interests),
-                "score": score
-            })
+    for row in rows.tolist():
+        other_id = user_ids[row]
+        other_interests = INTERESTS_CACHE.get(other_id)
+        if other_interests is None:
+            continue  # deleted since the scores were computed
+        candidates.append({
+            "user_id": other_id,
+            "name": NAME_CACHE.get(other_id),
+            "common_interests": list(me_interests & other_interests),
+            "score": int(scores[row])
+        })
 
     # sort by descending score (more interests in common first), then by name
     candidates.sort(key=lambda x: (-x["score"], x.get("name") or ""))
@@ -2,111 +2,145 @@
 import os
 import asyncio
 from dotenv import load_dotenv
-import httpx
+import orjson
 import uvicorn
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import Response
+from pydantic import TypeAdapter, ValidationError
 from mcp.server import Server
 from mcp.types import ToolResult  # depends on mcp package version; adjust if needed
 import logging
 
+try:
+    import uvloop  # installed with uvicorn[standard]; not available on Windows
+except ImportError:
+    uvloop = None
+
 # load env (will pick up AUTH_TOKEN, OWNER_PHONE from your .env)
 load_dotenv()
-AUTH_TOKEN = os.getenv("AUTH_TOKEN", "changeme")
 API_HOST = os.getenv("API_HOST", "0.0.0.0")
 API_PORT = int(os.getenv("API_PORT", "8000"))
-API_BASE = f"http://localhost:{API_PORT}"  # FastAPI address used by bridge
 
 # Import FastAPI app (your existing main.py must be in same folder / importable)
 import main as main_app_module  # noqa: E402
+from main import ConnectPayload, MessagePayload, SimplePayload, UserId  # noqa: E402
 app = main_app_module.app
 
 # create MCP server (bridge)
 mcp = Server(name="PuchMatch MCP Bridge")
 
-# helper to call your HTTP endpoints
-async def call_api(method: str, endpoint: str, json=None, params=None):
-    url = f"{API_BASE}{endpoint}"
-    headers = {"Authorization": f"Bearer {AUTH_TOKEN}"}
-    # small retry/backoff could be added here
-    async with httpx.AsyncClient(timeout=10.0) as client:
-        if method.lower() == "post":
-            resp = await client.post(url, json=json, headers=headers)
-        elif method.lower() == "get":
-            resp = await client.get(url, params=params, headers=headers)
-        else:
-            raise ValueError("unsupported method")
-    try:
-        return resp.json()
-    except Exception:
-        return {"status_code": resp.status_code, "text": resp.text}
-
+# query-param user_ids get the same stripping/length checks the HTTP routes apply
+parse_user_id = TypeAdapter(UserId).validate_python
 
-# Define MCP tools that proxy to HTTP endpoints
+# helper to run an endpoint in-process instead of over HTTP to localhost;
+# `make_call` builds the payload too, so validation errors are caught here
+async def call_endpoint(make_call):
+    try:
+        result = await make_call()
+    except ValidationError as exc:
+        # pydantic's error list, like FastAPI's 422 body minus the "body" prefix on each loc
+        return {"detail": jsonable_encoder(exc.errors())}
+    except HTTPException as exc:
+        # same body FastAPI would have sent back for the error
+        return {"detail": exc.detail}
+    if isinstance(result, Response):
+        # endpoints that hand back pre-encoded JSON (get_messages)
+        return orjson.loads(result.body)
+    return result
+
+
+# Define MCP tools that call the FastAPI endpoints directly
 @mcp.tool()
 async def validate() -> ToolResult:
-    return await call_api("post", "/validate")
+    return await call_endpoint(lambda: main_app_module.validate())
 
 
 @mcp.tool()
 async def join_chat(user_id: str, nickname: str = None) -> ToolResult:
-    payload = {"user_id": user_id, "nickname": nickname}
-    return await call_api("post", "/join_chat", json=payload)
+    return await call_endpoint(lambda: main_app_module.join_chat(ConnectPayload(user_id=user_id, nickname=nickname)))
 
 
 @mcp.tool()
 async def send_message(user_id: str, text: str) -> ToolResult:
-    payload = {"user_id": user_id, "text": text}
-    return await call_api("post", "/send_message", json=payload)
+    return await call_endpoint(lambda: main_app_module.send_message(MessagePayload(user_id=user_id, text=text)))
 
 
 @mcp.tool()
 async def get_messages(user_id: str) -> ToolResult:
-    return await call_api("get", "/get_messages", params={"user_id": user_id})
+    return await call_endpoint(lambda: main_app_module.get_messages(parse_user_id(user_id)))
 
 
 @mcp.tool()
 async def skip_user(user_id: str) -> ToolResult:
-    return await call_api("post", "/skip", json={"user_id": user_id})
+    return await call_endpoint(lambda: main_app_module.skip_user(SimplePayload(user_id=user_id)))
 
 
 @mcp.tool()
 async def leave(user_id: str) -> ToolResult:
-    return await call_api("post", "/leave", json={"user_id": user_id})
+    return await call_endpoint(lambda: main_app_module.leave(SimplePayload(user_id=user_id)))
 
 
 @mcp.tool()
 async def status(user_id: str) -> ToolResult:
-    return await call_api("get", "/status", params={"user_id": user_id})
+    return await call_endpoint(lambda: main_app_module.status(parse_user_id(user_id)))
 
 
 # Run uvicorn programmatically + MCP server (stdio)
-async def run_uvicorn():
-    """Run FastAPI app (main.app) via uvicorn programmatically so both run in same process."""
+class ReadyServer(uvicorn.Server):
+    """uvicorn.Server that sets `ready` once startup (lifespan + socket bind) has finished."""
+
+    def __init__(self, config: uvicorn.Config, ready: asyncio.Event):
+        super().__init__(config)
+        self.ready = ready
+
+    async def startup(self, sockets=None):
+        await super().startup(sockets=sockets)
+        if not self.should_exit:
+            self.ready.set()
+
+
+def make_uvicorn_server(ready: asyncio.Event) -> ReadyServer:
+    """Serve the FastAPI app (main.app) over HTTP for external clients; MCP tools call it in-process."""
+    # Single worker on purpose: matchmaking state lives in this process's memory
+    # and the MCP tools call main.py directly, so extra workers would split it.
     config = uvicorn.Config(app, host=API_HOST, port=API_PORT, log_level="info")
-    server = uvicorn.Server(config)
-    await server.serve()  # returns when server stops
+    return ReadyServer(config, ready)
 
 
 async def main():
     logging.basicConfig(level=logging.INFO)
-    # start uvicorn in a background task
-    uvicorn_task = asyncio.create_task(run_uvicorn())
-    # give uvicorn a moment to start before MCP begins handling calls
-    await asyncio.sleep(0.5)
-
-    # Run the MCP server over stdio (this blocks until stdio server stops)
-    # Many MCP clients expect stdio. If you need TCP/WS instead, see note below.
-    await mcp.run_stdio()
-
-    # If MCP stops, shut down uvicorn
-    uvicorn_task.cancel()
-    try:
-        await uvicorn_task
-    except asyncio.CancelledError:
-        pass
+    ready = asyncio.Event()
+    server = make_uvicorn_server(ready)
+    # the task group tears both sides down together if either one fails or we are interrupted
+    async with asyncio.TaskGroup() as tg:
+        serve_task = tg.create_task(server.serve())
+        # wait for uvicorn's startup to complete before MCP begins handling calls,
+        # but stop at once if serve() ends first (e.g. lifespan startup failed)
+        ready_task = asyncio.create_task(ready.wait())
+        try:
+            await asyncio.wait({serve_task, ready_task}, timeout=5.0, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            ready_task.cancel()
+        if not ready.is_set():
+            if serve_task.done():
+                # an exception from serve() is raised by the task group; a clean
+                # return means uvicorn already logged why startup failed
+                raise RuntimeError("uvicorn exited during startup; see the log above")
+            raise TimeoutError("uvicorn did not finish startup within 5 s")
+
+        # Run the MCP server over stdio (this blocks until stdio server stops)
+        # Many MCP clients expect stdio. If you need TCP/WS instead, see note below.
+        await mcp.run_stdio()
+
+        # If MCP stops, ask uvicorn to shut down gracefully
+        server.should_exit = True
 
 
 if __name__ == "__main__":
+    # serve() runs on whatever loop is current, so pick uvloop for the whole process here
+    run = uvloop.run if uvloop is not None else asyncio.run
     try:
-        asyncio.run(main())
+        run(main())
     except KeyboardInterrupt:
         print("Shutting down.")
@@ -0,0 +1,125 @@
+# test_matchmaking.py
+# Skip cooldown and waiting-queue behaviour, driving the endpoint coroutines directly.
+import asyncio
+import random
+
+import pytest
+
+import main
+
+COOLDOWN_NS = 5_000_000_000
+
+
+@pytest.fixture(autouse=True)
+def fresh_state(monkeypatch):
+    main.waiting_queue.clear()
+    main.waiting_set.clear()
+    main.join_seq.clear()
+    main.departed_seqs.clear()
+    main.head_seq = 0
+    main.next_seq = 0
+    main.active_pairs.clear()
+    main.RECENTLY_UNPAIRED.clear()
+    main.inbox.clear()
+    main.NONEMPTY.clear()
+    main.meta.clear()
+    monkeypatch.setattr(main, "SKIP_COOLDOWN_NS", COOLDOWN_NS)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [0]
+    monkeypatch.setattr(main.time, "monotonic_ns", lambda: now[0])
+    return now
+
+
+def join(user_id):
+    return asyncio.run(main.join_chat(main.ConnectPayload(user_id=user_id)))
+
+
+def skip(user_id):
+    return asyncio.run(main.skip_user(main.SimplePayload(user_id=user_id)))
+
+
+def leave(user_id):
+    return asyncio.run(main.leave(main.SimplePayload(user_id=user_id)))
+
+
+def status(user_id):
+    return asyncio.run(main.status(user_id))
+
+
+def test_skip_does_not_rematch_the_skipped_partner(clock):
+    join("a")
+    assert join("b")["partner_id"] == "a"
+    assert skip("a") == {"status": "waiting"}
+    assert status("a")["status"] == "waiting"
+    assert status("b")["status"] == "waiting"
+
+
+def test_skip_passes_over_every_blocked_candidate(clock):
+    join("p1")
+    join("x")  # x - p1
+    join("w")  # waiting
+    assert skip("x") == {"status": "matched", "partner_id": "w"}
+    # p1 is still blocked for x, so the second skip must not pair them
+    assert skip("x") == {"status": "waiting"}
+    assert main._blocked("x", "p1")
+    # w went back into the queue and pairs with the waiting p1 instead
+    assert status("p1") == {"status": "matched", "partner_id": "w"}
+    assert status("x")["status"] == "waiting"
+
+
+def test_cooldown_is_blocked_both_ways(clock):
+    join("a")
+    join("b")
+    skip("a")
+    leave("b")
+    assert join("b") == {"status": "waiting"}
+    assert main.active_pairs.get("b") is None
+
+
+def test_waiting_pair_matches_once_cooldown_lapses(clock):
+    join("a")
+    join("b")
+    skip("a")
+    clock[0] += COOLDOWN_NS
+    assert join("a")["partner_id"] == "b"
+    assert status("b") == {"status": "matched", "partner_id": "a"}
+
+
+def test_requeued_partner_is_paired_with_unblocked_waiting_user(clock):
+    join("s")
+    join("t")  # s - t
+    join("x")
+    join("p")  # x - p
+    skip("x")  # x and p wait, blocked from each other
+    assert skip("s") == {"status": "matched", "partner_id": "p"}
+    # t went back into the queue and is free to pair with x
+    assert status("t") == {"status": "matched", "partner_id": "x"}
+    assert not main.waiting_set
+
+
+def test_random_operations_keep_queue_invariants(clock):
+    rng = random.Random(0)
+    for _ in range(5000):
+        user_id = f"u{rng.randint(0, 12)}"
+        before = dict(main.active_pairs)
+        op = rng.random()
+        if op < 0.4:
+            join(user_id)
+        elif op < 0.55:
+            leave(user_id)
+        else:
+            skip(user_id)
+        clock[0] += rng.randint(0, COOLDOWN_NS // 20)
+
+        for a, b in main.active_pairs.items():
+            assert main.active_pairs[b] == a
+            assert a not in main.waiting_set
+            if before.get(a) != b:
+                assert not main._blocked(a, b)
+        live = [uid for seq, uid in main.waiting_queue if main.join_seq.get(uid) == seq]
+        assert set(live) == main.waiting_set and len(live) == len(main.waiting_set)
+        for i, uid in enumerate(live):
+            assert main.queue_position(uid) == i